@@ -1,11 +1,12 @@
 import asyncio
-import json
+import random
 import re
+import sys
 import time
-from collections import OrderedDict
+import traceback
+import zlib
 from contextlib import contextmanager
 from contextlib import suppress
-from datetime import datetime
 from functools import wraps
 from types import SimpleNamespace as Story
 
@@ -14,19 +15,35 @@ from aiosseclient import aiosseclient
 from colorama import Fore
 from colorama import Style
 
+try:
+    import orjson as json
+except ImportError:
+    import json
+
+try:
+    import uvloop
+except ImportError:
+    uvloop = None
+
 
 FETCH_ATTEMPTS = 3
 FETCH_RETRY_DELAY = 3
+FETCH_WORKERS = 8
+OUTPUT_BUFFER_SIZE = 1024
+SEEN_PATH = '/tmp/hn_seen'
 
 BASE_URL = 'https://hacker-news.firebaseio.com/v0'
 STORIES_URL = f'{BASE_URL}/newstories.json'
 ITEM_URL = f'{BASE_URL}/item'
 WEB_ITEM_URL = 'https://news.ycombinator.com/item?id='
+ITEM_ANCHOR = b'"title"><a href="'
 ITEM_PATTERN = re.compile(
-    r'"title"><a href="(?P<url>.*?)".*?>(?P<title>.*?)</a>',
+    rb'"title"><a href="([^"]*)"[^>]*>([^<]*)</a>',
+    re.ASCII,
 )
 
 HEADERS = {'Accept': 'application/json'}
+FETCH_TIMEOUT = aiohttp.ClientTimeout(total=15)
 FIREBASE_TIMEOUT = 30 + 5
 SSE_TIMEOUT = aiohttp.ClientTimeout(
     total=None,
@@ -35,53 +52,52 @@ SSE_TIMEOUT = aiohttp.ClientTimeout(
     sock_read=FIREBASE_TIMEOUT,
 )
 
+TIME_STYLE = f'{Style.BRIGHT}{Fore.BLUE}'.encode()
+TITLE_STYLE = f' {Style.NORMAL}{Fore.CYAN}'.encode()
+ID_STYLE = f' {Style.BRIGHT}{Fore.GREEN}'.encode()
+RESET_STYLE = f'\n{Style.RESET_ALL}'.encode()
 INVALID_MSG = f'\n\n{Style.NORMAL}{Fore.RED}{{}}{Style.RESET_ALL}\n\n'
 RETRYING_MSG = f'{Fore.RED}Retrying...{Style.RESET_ALL}'
 
 ERRORS = (
     asyncio.TimeoutError,
-    aiohttp.client_exceptions.ClientConnectorError,
+    aiohttp.client_exceptions.ClientConnectionError,
 )
 
+DELETED = object()
 
-class LRU(OrderedDict):
-    def __init__(self, maxsize=128, *args, **kwds):
-        self.maxsize = maxsize
-        super().__init__(*args, **kwds)
-
-    def __contains__(self, key):
-        found = super().__contains__(key)
-        if found:
-            self.move_to_end(key)
-        else:
-            self[key] = None
-        return found
+SESSION = None
+OUTPUT = None
 
-    def __getitem__(self, key):
-        self.move_to_end(key)
-        return super().__getitem__(key)
 
-    def __setitem__(self, key, value):
-        if super().__contains__(key):
-            self.move_to_end(key)
-        else:
-            super().__setitem__(key, value)
-        if len(self) > self.maxsize:
-            oldest = next(iter(self))
-            del self[oldest]
+def get_session():
+    global SESSION
+    if SESSION is None:
+        SESSION = aiohttp.ClientSession(
+            connector=aiohttp.TCPConnector(
+                limit=64,
+                limit_per_host=16,
+                ttl_dns_cache=600,
+                keepalive_timeout=75,
+                enable_cleanup_closed=True,
+            ),
+            headers=HEADERS,
+            timeout=FETCH_TIMEOUT,
+        )
+    return SESSION
 
 
 def retry(func):
     @wraps(func)
     async def wrapper(*args, **kwargs):
-        for _ in range(FETCH_ATTEMPTS):
-            result = await func(*args, **kwargs)
-            if not result:
-                await asyncio.sleep(FETCH_RETRY_DELAY)
-            else:
-                break
-
-        return result
+        for attempt in range(FETCH_ATTEMPTS):
+            try:
+                return await func(*args, **kwargs)
+            except ERRORS:
+                if attempt < FETCH_ATTEMPTS - 1:
+                    await asyncio.sleep(
+                        FETCH_RETRY_DELAY * 2 ** attempt + random.random(),
+                    )
 
     return wrapper
 
@@ -89,40 +105,53 @@ def retry(func):
 @retry
 async def api_fetch(story_id):
     url = f'{ITEM_URL}/{story_id}.json'
-    async with aiohttp.ClientSession() as session:
-        with suppress(aiohttp.client_exceptions.ClientConnectorError):
-            async with session.get(url, headers=HEADERS) as resp:
-                if resp.status == 200:
-                    result = await resp.json()
-                    if result:
-                        return Story(**result)
+    async with SESSION.get(url) as resp:
+        if resp.status == 200:
+            result = json.loads(await resp.read())
+            if result:
+                return Story(**result)
+            return DELETED
+
+
+def parse_item(html):
+    start = html.find(ITEM_ANCHOR)
+    if start == -1:
+        match = ITEM_PATTERN.search(html)
+        if match:
+            return match.group(1).decode(), match.group(2).decode()
+        return None
+
+    start += len(ITEM_ANCHOR)
+    url_end = html.find(b'"', start)
+    title_start = html.find(b'>', url_end) + 1
+    title_end = html.find(b'</a>', title_start)
+    if url_end == -1 or title_start == 0 or title_end == -1:
+        return None
+    return html[start:url_end].decode(), html[title_start:title_end].decode()
 
 
 @retry
 async def web_fetch(story_id, timestamp):
     url = f'{WEB_ITEM_URL}{story_id}'
-    async with aiohttp.ClientSession() as session:
-        with suppress(aiohttp.client_exceptions.ClientConnectorError):
-            async with session.get(url, headers=HEADERS) as resp:
-                if resp.status == 200:
-                    html = await resp.text()
-                    match = ITEM_PATTERN.search(html)
-                    if match:
-                        return Story(
-                            id=story_id,
-                            url=match.group('url'),
-                            title=match.group('title'),
-                            time=timestamp,
-                        )
+    async with SESSION.get(url) as resp:
+        if resp.status == 200:
+            item = parse_item(await resp.read())
+            if item:
+                story_url, title = item
+                return Story(
+                    id=story_id,
+                    url=story_url,
+                    title=title,
+                    time=timestamp,
+                )
 
 
 @contextmanager
 def fetcher():
     async def fetch(story_id, timestamp):
-        if not getattr(fetch, 'enable', False):
-            return
-
         story = await api_fetch(story_id)
+        if story is DELETED:
+            return
         if story:
             return story
 
@@ -136,49 +165,137 @@ def fetcher():
 
 
 async def announce(story):
-    posted_at = datetime.fromtimestamp(int(story.time)).strftime('%H:%M:%S')
-    print(
-        f'{Style.BRIGHT}{Fore.BLUE}{posted_at} '
-        f'{Style.NORMAL}{Fore.CYAN}{getattr(story, "title", "-")} '
-        f'{Style.BRIGHT}{Fore.GREEN}{story.id}\n'
-        f'{Style.RESET_ALL}{getattr(story, "url", "-")}',
+    posted = time.localtime(int(story.time))
+    posted_at = f'{posted.tm_hour:02d}:{posted.tm_min:02d}:{posted.tm_sec:02d}'
+    line = (
+        TIME_STYLE + posted_at.encode()
+        + TITLE_STYLE + getattr(story, 'title', '-').encode()
+        + ID_STYLE + str(story.id).encode()
+        + RESET_STYLE + getattr(story, 'url', '-').encode()
+        + b'\n'
     )
+    await OUTPUT.put(line)
+
+
+async def writer():
+    while True:
+        batch = [await OUTPUT.get()]
+        while not OUTPUT.empty():
+            batch.append(OUTPUT.get_nowait())
+        sys.stdout.buffer.write(b''.join(batch))
+        sys.stdout.buffer.flush()
+
+
+def load_max_id():
+    try:
+        with open(SEEN_PATH) as cache:
+            return int(cache.read())
+    except (OSError, ValueError):
+        return 0
+
+
+def save_max_id(max_id):
+    with suppress(OSError):
+        with open(SEEN_PATH, 'w') as cache:
+            cache.write(str(max_id))
 
 
 def load_stories(event_data):
-    stories = json.loads(event_data)
-    if not stories:
+    if not event_data or len(event_data) < 16:
         return
-    else:
-        stories = stories.get('data', [])
-        stories.sort()
-        yield from stories
+
+    crc = zlib.crc32(event_data.encode())
+    if crc == load_stories.last_crc:
+        return
+
+    load_stories.last_crc = crc
+    stories = json.loads(event_data)
+    if stories:
+        yield from stories.get('data', ())
+
+
+load_stories.last_crc = None
 
 
 async def hackernews_feed():
-    seen = LRU(1024)
+    get_session()
+    todo = asyncio.Queue()
+    done = asyncio.Queue()
+
     with fetcher() as fetch:
-        async for event in aiosseclient(STORIES_URL, timeout=SSE_TIMEOUT):
-            for story_id in load_stories(event.data):
-                if story_id not in seen:
-                    story = await fetch(story_id, time.time())
-                    if story:
-                        yield story
-            else:
-                fetch.enable = True
+        async def reader():
+            enqueue = todo.put_nowait
+            max_id = load_max_id()
+            primed = max_id > 0
+            async for event in aiosseclient(STORIES_URL, timeout=SSE_TIMEOUT):
+                new_max = max_id
+                for story_id in load_stories(event.data):
+                    if story_id > max_id:
+                        if story_id > new_max:
+                            new_max = story_id
+                        if primed:
+                            enqueue(story_id)
+                if new_max > max_id:
+                    max_id = new_max
+                    save_max_id(max_id)
+
+                primed = True
+
+        async def worker():
+            now = time.time
+            publish = done.put_nowait
+            while True:
+                story_id = await todo.get()
+                try:
+                    story = await fetch(story_id, now())
+                except Exception:
+                    traceback.print_exc()
+                    continue
+                if story:
+                    publish(story)
+
+        reading = asyncio.create_task(reader())
+        workers = [asyncio.create_task(worker()) for _ in range(FETCH_WORKERS)]
+        try:
+            while not reading.done():
+                getter = asyncio.create_task(done.get())
+                await asyncio.wait(
+                    {getter, reading},
+                    return_when=asyncio.FIRST_COMPLETED,
+                )
+                if getter.done():
+                    yield getter.result()
+                else:
+                    getter.cancel()
+
+            reading.result()
+        finally:
+            reading.cancel()
+            for task in workers:
+                task.cancel()
 
 
 async def main():
-    while True:
-        try:
-            async for story in hackernews_feed():
-                await announce(story)
-        except ERRORS:
-            print(f'{time.strftime("%X")} {RETRYING_MSG}')
-            await asyncio.sleep(FIREBASE_TIMEOUT)
+    global OUTPUT
+    OUTPUT = asyncio.Queue(maxsize=OUTPUT_BUFFER_SIZE)
+    writing = asyncio.create_task(writer())
+    try:
+        while True:
+            try:
+                async for story in hackernews_feed():
+                    await announce(story)
+            except ERRORS:
+                print(f'{time.strftime("%X")} {RETRYING_MSG}')
+                await asyncio.sleep(FIREBASE_TIMEOUT)
+    finally:
+        writing.cancel()
+        if SESSION is not None:
+            await SESSION.close()
 
 
 if __name__ == '__main__':
+    if uvloop is not None:
+        uvloop.install()
     try:
         asyncio.run(main())
     except KeyboardInterrupt: